@@ -0,0 +1,44 @@
+from decimal import Decimal
+from typing import Union
+
+
+SATS_IN_BTC = 100_000_000
+# Тот же множитель в виде Decimal, создается один раз
+SATS_PER_BTC = Decimal(SATS_IN_BTC)
+
+
+def btc_to_sat(amount: Union[Decimal, float, str, int]) -> int:
+    """
+    Перевести сумму в BTC в сатоши целочисленной арифметикой
+
+    Args:
+        amount: Сумма в BTC (Decimal или строка из ответа RPC, либо float)
+
+    Returns:
+        int: Сумма в сатоши (знаки после 8-го отбрасываются для всех типов)
+    """
+    if isinstance(amount, float):
+        # repr дает кратчайшую десятичную запись float ('0.1', а не двоичное
+        # приближение), дальше сумма обрабатывается так же, как Decimal
+        amount = Decimal(repr(amount))
+
+    # format(..., 'f') раскрывает экспоненциальную запись вида Decimal('1E-8')
+    text = format(amount, 'f') if isinstance(amount, Decimal) else str(amount)
+    sign = -1 if text.startswith('-') else 1
+    whole, _, frac = text.lstrip('+-').partition('.')
+    return sign * (int(whole or '0') * SATS_IN_BTC + int((frac + '00000000')[:8]))
+
+
+def sat_to_btc_str(sats: int) -> str:
+    """
+    Записать сумму в сатоши строкой BTC ровно с 8 знаками после точки
+
+    Args:
+        sats: Сумма в сатоши
+
+    Returns:
+        str: Сумма в BTC, например '0.00100000'
+    """
+    sign = '-' if sats < 0 else ''
+    whole, frac = divmod(abs(sats), SATS_IN_BTC)
+    return f"{sign}{whole}.{frac:08d}"
@@ -1,10 +1,54 @@
-from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException
+from array import array
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import http.client
 import json
+import sys
+import threading
 from decimal import Decimal
+from typing import Iterable, Iterator, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+from btc_units import SATS_IN_BTC, SATS_PER_BTC, btc_to_sat, sat_to_btc_str
+from node_rpc import AsyncAuthProxy, FastAuthProxy, JSONRPCException, HTTP_TIMEOUT, basic_auth_header
+from rpc_cache import block_aware_cache
+
+# Время жизни кэша адресов портфеля в пределах одного блока (секунды)
+ADDRESS_CACHE_TTL = 30
+
+# Имя сети узла, запрошенное один раз за процесс: {(ip, порт): сеть}
+_chain_cache: dict[tuple[str, int], str] = {}
+
+# Префиксы bech32-адресов: они нечувствительны к регистру, узел возвращает их строчными
+BECH32_PREFIXES = ('bc1', 'tb1', 'bcrt1')
+
+
+def _address_key(address: str) -> str:
+    """Привести адрес к виду, в котором его возвращает узел"""
+    lowered = address.lower()
+    # Base58-адреса чувствительны к регистру — их не трогаем
+    return lowered if lowered.startswith(BECH32_PREFIXES) else address
+
+
+# Непотраченные выходы адреса в виде параллельных столбцов
+UnspentBatch = namedtuple('UnspentBatch', [
+    'transaction_ids',  # list[str]
+    'output_indexes',   # array('i')
+    'sats_values',      # array('q')
+    'confirmations',    # array('i')
+    'spendable',        # array('b')
+    'secure'            # array('b')
+])
 
 
 class DigitalAssetPortfolioInspector:
-    def __init__(self, node_user, node_pass, node_ip='127.0.0.1', node_port=8332, portfolio_label=''):
+    def __init__(self, node_user: str, node_pass: str, node_ip: str = '127.0.0.1', node_port: int = 8332,
+                 portfolio_label: str = '', rpc_workers: int = 4) -> None:
         """
         Инициализация подключения к узлу Bitcoin
 
@@ -14,12 +58,14 @@ class DigitalAssetPortfolioInspector:
             node_ip: IP адрес узла
             node_port: Порт узла
             portfolio_label: Метка портфеля (для мультикошельковой конфигурации)
+            rpc_workers: Количество потоков для параллельных RPC-запросов
         """
         self.node_user = node_user
         self.node_pass = node_pass
         self.node_ip = node_ip
         self.node_port = node_port
         self.portfolio_label = portfolio_label
+        self.rpc_workers = rpc_workers
 
         # Формируем строку подключения
         if portfolio_label:
@@ -27,22 +73,70 @@ class DigitalAssetPortfolioInspector:
         else:
             self.connection_string = f"http://{node_user}:{node_pass}@{node_ip}:{node_port}/"
 
-        self.node_client = None
+        # Путь RPC и заголовок авторизации вычисляются один раз для всех клиентов
+        self._path = f"/wallet/{portfolio_label}" if portfolio_label else "/"
+        self._auth_header = basic_auth_header(node_user, node_pass)
+
+        self.node_client: Optional[FastAuthProxy] = None
+        # Одно постоянное HTTP-соединение (keep-alive) на все RPC-вызовы
+        self._conn = http.client.HTTPConnection(node_ip, node_port, timeout=HTTP_TIMEOUT)
+        # Кэш block_aware_cache: {(метод, аргументы): (лучший блок, время, результат)}
+        self._block_cache: dict[tuple, tuple] = {}
+
+        # Пул потоков для параллельных запросов; у каждого потока свой клиент,
+        # так как http.client.HTTPConnection не потокобезопасен
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._thread_conns: list[http.client.HTTPConnection] = []
+        self._thread_conns_lock = threading.Lock()
 
-    def establish_link(self):
+    def establish_link(self) -> bool:
         """Установить соединение с узлом"""
         try:
-            self.node_client = AuthServiceProxy(self.connection_string)
-            # Тестируем подключение
-            blockchain_data = self.node_client.getblockchaininfo()
-            print(f"✓ Успешное подключение к сети: {blockchain_data['chain']}")
-            print(f"✓ Текущая высота: {blockchain_data['blocks']}")
+            if self.node_client is None:
+                self.node_client = FastAuthProxy.from_connection(self._conn, self._path, self._auth_header)
+            # Тестируем подключение: полный getblockchaininfo нужен только
+            # при первом подключении, дальше достаточно легкого getblockcount
+            node_key = (self.node_ip, self.node_port)
+            chain = _chain_cache.get(node_key)
+            if chain is None:
+                blockchain_data = self.node_client.getblockchaininfo()
+                chain = _chain_cache[node_key] = blockchain_data['chain']
+                block_height = blockchain_data['blocks']
+            else:
+                block_height = self.node_client.getblockcount()
+            print(f"✓ Успешное подключение к сети: {chain}")
+            print(f"✓ Текущая высота: {block_height}")
             return True
         except Exception as error:
             print(f"✗ Ошибка подключения: {error}")
             return False
 
-    def calculate_unspent_balance(self, target_address):
+    def close(self) -> None:
+        """Закрыть соединение с узлом"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        with self._thread_conns_lock:
+            for conn in self._thread_conns:
+                conn.close()
+            self._thread_conns = []
+        self._local = threading.local()
+        self._conn.close()
+        self.node_client = None
+
+    def _thread_client(self) -> FastAuthProxy:
+        """RPC-клиент текущего потока со своим постоянным соединением"""
+        client = getattr(self._local, 'node_client', None)
+        if client is None:
+            conn = http.client.HTTPConnection(self.node_ip, self.node_port, timeout=HTTP_TIMEOUT)
+            with self._thread_conns_lock:
+                self._thread_conns.append(conn)
+            client = FastAuthProxy.from_connection(conn, self._path, self._auth_header)
+            self._local.node_client = client
+        return client
+
+    def calculate_unspent_balance(self, target_address: str) -> Optional[dict]:
         """
         Рассчитать сумму всех непотраченных выходов для адреса
 
@@ -50,47 +144,115 @@ class DigitalAssetPortfolioInspector:
             target_address: Целевой адрес
 
         Returns:
-            dict: {'total_btc': Decimal, 'total_sats': int, 'unspent_count': int, 'unspent_list': list}
+            dict: {'total_btc': Decimal, 'total_sats': int, 'unspent_count': int, 'unspent_batch': UnspentBatch}
+        """
+        if not self.node_client:
+            print("Сначала выполните подключение через establish_link()")
+            return None
+
+        reports = self._collect_unspent(self.node_client, [target_address])
+        return reports[target_address] if reports is not None else None
+
+    def calculate_unspent_balances(self, target_addresses: Iterable[str]) -> Optional[dict[str, dict]]:
+        """
+        Рассчитать непотраченные выходы для нескольких адресов одним запросом listunspent
+
+        Args:
+            target_addresses: Список целевых адресов
+
+        Returns:
+            dict: {адрес: результат calculate_unspent_balance}
+        """
+        if not self.node_client:
+            print("Сначала выполните подключение через establish_link()")
+            return None
+
+        addresses = list(dict.fromkeys(target_addresses))
+        if not addresses:
+            # Пустой список для listunspent означает «без фильтра» — все выходы кошелька
+            return {}
+
+        # Узел отклоняет повторяющиеся адреса (в том числе bech32 в разном
+        # регистре), поэтому запрашиваем каждый адрес один раз в его
+        # каноническом виде и раскладываем отчеты по написаниям вызывающего
+        reports = self._collect_unspent(self.node_client, list(dict.fromkeys(map(_address_key, addresses))))
+        if reports is None:
+            return None
+        return {address: reports[_address_key(address)] for address in addresses}
+
+    def calculate_unspent_balance_many(self, target_addresses: Iterable[str]) -> Optional[dict[str, Optional[dict]]]:
+        """
+        Рассчитать непотраченные выходы для нескольких адресов параллельно
+
+        Запросы listunspent по адресам выполняются одновременно в пуле потоков.
+
+        Args:
+            target_addresses: Список целевых адресов
+
+        Returns:
+            dict: {адрес: результат calculate_unspent_balance}
         """
         if not self.node_client:
             print("Сначала выполните подключение через establish_link()")
             return None
 
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.rpc_workers)
+
+        def collect(address: str) -> Optional[dict]:
+            reports = self._collect_unspent(self._thread_client(), [address])
+            return reports[address] if reports is not None else None
+
+        addresses = list(dict.fromkeys(target_addresses))
+        return dict(zip(addresses, self._pool.map(collect, addresses)))
+
+    async def calculate_unspent_balance_many_async(self, target_addresses: Iterable[str],
+                                                   concurrency: int = 32) -> Optional[dict[str, Optional[dict]]]:
+        """
+        Рассчитать непотраченные выходы для нескольких адресов асинхронно
+
+        Запросы listunspent по адресам выполняются одновременно в цикле
+        событий (требуется пакет aiohttp).
+
+        Args:
+            target_addresses: Список целевых адресов
+            concurrency: Максимальное число одновременных соединений
+
+        Returns:
+            dict: {адрес: результат calculate_unspent_balance}
+        """
+        addresses = list(dict.fromkeys(target_addresses))
         try:
-            # Запрашиваем непотраченные транзакции
-            unspent_transactions = self.node_client.listunspent(0, 9999999, [target_address])
-
-            cumulative_sats = 0
-            unspent_items = []
-
-            for transaction in unspent_transactions:
-                # Подтверждаем принадлежность адресу
-                if transaction['address'] == target_address:
-                    sats_value = int(Decimal(transaction['amount']) * Decimal('1e8'))
-                    cumulative_sats += sats_value
-
-                    transaction_record = {
-                        'transaction_id': transaction['txid'],
-                        'output_index': transaction['vout'],
-                        'btc_value': float(transaction['amount']),
-                        'sats_value': sats_value,
-                        'confirmations': transaction['confirmations'],
-                        'spendable': transaction['spendable'],
-                        'secure': transaction.get('safe', True)
-                    }
-                    unspent_items.append(transaction_record)
-
-            total_btc = Decimal(cumulative_sats) / Decimal('1e8')
-
-            report = {
-                'address': target_address,
-                'total_btc': total_btc,
-                'total_sats': cumulative_sats,
-                'unspent_count': len(unspent_items),
-                'unspent_list': unspent_items
-            }
+            async with AsyncAuthProxy(self.connection_string, concurrency=concurrency) as client:
+                results = await asyncio.gather(
+                    *[client.call('listunspent', 0, 9999999, [address]) for address in addresses],
+                    return_exceptions=True
+                )
+        except Exception as error:
+            print(f"✗ Общая ошибка: {error}")
+            return None
+
+        reports: dict[str, Optional[dict]] = {}
+        for address, unspent_transactions in zip(addresses, results):
+            if isinstance(unspent_transactions, JSONRPCException):
+                print(f"✗ Ошибка RPC: {unspent_transactions}")
+                reports[address] = None
+            elif isinstance(unspent_transactions, BaseException):
+                # gather(return_exceptions=True) возвращает и CancelledError,
+                # который не наследует Exception
+                print(f"✗ Общая ошибка: {unspent_transactions}")
+                reports[address] = None
+            else:
+                reports[address] = self._summarize_unspent([address], unspent_transactions)[address]
+        return reports
+
+    def _collect_unspent(self, client: FastAuthProxy, target_addresses: list[str]) -> Optional[dict[str, dict]]:
+        """Запросить непотраченные выходы адресов у узла через указанный клиент"""
+        try:
+            # Запрашиваем непотраченные транзакции; выходы разбираются потоково
+            unspent_transactions = client.stream_('listunspent', 0, 9999999, target_addresses)
 
-            return report
+            return self._summarize_unspent(target_addresses, unspent_transactions)
 
         except JSONRPCException as rpc_error:
             print(f"✗ Ошибка RPC: {rpc_error}")
@@ -99,20 +261,90 @@ class DigitalAssetPortfolioInspector:
             print(f"✗ Общая ошибка: {error}")
             return None
 
-    def fetch_portfolio_total(self):
+    def _summarize_unspent(self, target_addresses: list[str], unspent_transactions: Iterable[dict]) -> dict[str, dict]:
+        """Свести ответ listunspent в отчеты по адресам"""
+        # listunspent с фильтром по адресам возвращает только выходы этих
+        # адресов, поэтому повторно проверять принадлежность не нужно
+        if len(target_addresses) == 1:
+            address = target_addresses[0]
+            return {address: self._build_unspent_report(address, unspent_transactions)}
+
+        # Адреса уже приведены к виду, в котором их возвращает узел (_address_key)
+        grouped: dict[str, list[dict]] = {address: [] for address in target_addresses}
+        unexpected_count = 0
+        for transaction in unspent_transactions:
+            matched = grouped.get(transaction['address'])
+            if matched is None:
+                unexpected_count += 1
+            else:
+                matched.append(transaction)
+
+        # Выход чужого адреса не должен лишать отчетов остальные адреса
+        if unexpected_count:
+            print(f"✗ Пропущено выходов по незапрошенным адресам: {unexpected_count}")
+
+        return {address: self._build_unspent_report(address, matched)
+                for address, matched in grouped.items()}
+
+    def _build_unspent_report(self, target_address: str, matched: Iterable[dict]) -> dict:
+        """Построить отчет по выходам одного адреса"""
+        # Раскладываем выходы по столбцам вместо словаря на каждый выход;
+        # один проход, поэтому подходит и потоковый итератор ответа
+        unspent_batch = UnspentBatch(
+            transaction_ids=[],
+            output_indexes=array('i'),
+            sats_values=array('q'),
+            confirmations=array('i'),
+            spendable=array('b'),
+            secure=array('b')
+        )
+        for transaction in matched:
+            unspent_batch.transaction_ids.append(transaction['txid'])
+            unspent_batch.output_indexes.append(transaction['vout'])
+            unspent_batch.sats_values.append(btc_to_sat(transaction['amount']))
+            unspent_batch.confirmations.append(transaction['confirmations'])
+            unspent_batch.spendable.append(transaction['spendable'])
+            unspent_batch.secure.append(transaction.get('safe', True))
+
+        # Свертка сумм встроенным sum()
+        cumulative_sats = sum(unspent_batch.sats_values)
+        total_btc = Decimal(cumulative_sats) / SATS_PER_BTC
+
+        report = {
+            'address': target_address,
+            'total_btc': total_btc,
+            'total_sats': cumulative_sats,
+            'unspent_count': len(unspent_batch.transaction_ids),
+            'unspent_batch': unspent_batch
+        }
+
+        return report
+
+    def fetch_portfolio_total(self) -> Optional[dict]:
         """Получить общий баланс портфеля"""
+        if not self.node_client:
+            print("Сначала выполните подключение через establish_link()")
+            return None
+
         try:
             portfolio_total = self.node_client.getbalance()
+            # Через сатоши: с orjson сумма приходит как float
+            portfolio_sats = btc_to_sat(portfolio_total)
             return {
-                'portfolio_btc': Decimal(portfolio_total),
-                'portfolio_sats': int(Decimal(portfolio_total) * Decimal('1e8'))
+                'portfolio_btc': Decimal(portfolio_sats) / SATS_PER_BTC,
+                'portfolio_sats': portfolio_sats
             }
         except Exception as error:
             print(f"✗ Ошибка запроса баланса: {error}")
             return None
 
-    def enumerate_addresses(self):
+    @block_aware_cache(ttl=ADDRESS_CACHE_TTL)
+    def enumerate_addresses(self) -> list[dict]:
         """Получить перечень адресов в портфеле"""
+        if not self.node_client:
+            print("Сначала выполните подключение через establish_link()")
+            return []
+
         try:
             address_collection = []
 
@@ -131,35 +363,85 @@ class DigitalAssetPortfolioInspector:
             return []
 
 
-def display_balance_report(report_data):
+def display_balance_report(report_data: Optional[dict]) -> None:
     """Форматированный вывод результатов"""
     if not report_data:
         print("Отсутствуют данные для отображения")
         return
 
-    print("\n" + "=" * 60)
-    print(f"Анализ непотраченных выходов для адреса: {report_data['address']}")
-    print("=" * 60)
-    print(f"Всего непотраченных выходов: {report_data['unspent_count']}")
-    print(f"Общий баланс: {report_data['total_btc']:.8f} BTC")
-    print(f"Общий баланс: {report_data['total_sats']:,} сатоши")
-    print("-" * 60)
-
-    if report_data['unspent_list']:
-        print("\nДетализация выходов:")
-        print("-" * 60)
-        for idx, utxo in enumerate(report_data['unspent_list'], 1):
-            print(f"{idx}. Идентификатор: {utxo['transaction_id'][:20]}...")
-            print(f"   Индекс выхода: {utxo['output_index']}")
-            print(f"   Сумма: {utxo['btc_value']:.8f} BTC ({utxo['sats_value']:,} сатоши)")
-            print(f"   Подтверждений: {utxo['confirmations']}")
-            print(f"   Доступность: {'Да' if utxo['spendable'] else 'Нет'}")
-            print("-" * 40)
+    # Собираем весь отчет в список строк и выводим одной записью в stdout
+    lines = [
+        "",
+        "=" * 60,
+        f"Анализ непотраченных выходов для адреса: {report_data['address']}",
+        "=" * 60,
+        f"Всего непотраченных выходов: {report_data['unspent_count']}",
+        f"Общий баланс: {report_data['total_btc']:.8f} BTC",
+        f"Общий баланс: {report_data['total_sats']:,} сатоши",
+        "-" * 60
+    ]
+
+    if report_data['unspent_count']:
+        batch = report_data['unspent_batch']
+        lines.append("\nДетализация выходов:")
+        lines.append("-" * 60)
+        separator = "-" * 40
+        for idx in range(report_data['unspent_count']):
+            sats_value = batch.sats_values[idx]
+            lines.append(
+                f"{idx + 1}. Идентификатор: {batch.transaction_ids[idx][:20]}...\n"
+                f"   Индекс выхода: {batch.output_indexes[idx]}\n"
+                f"   Сумма: {sat_to_btc_str(sats_value)} BTC ({sats_value:,} сатоши)\n"
+                f"   Подтверждений: {batch.confirmations[idx]}\n"
+                f"   Доступность: {'Да' if batch.spendable[idx] else 'Нет'}\n"
+                f"{separator}"
+            )
+    else:
+        lines.append("Непотраченные выходы не обнаружены")
+
+    lines.append("")
+    sys.stdout.write("\n".join(lines))
+
+
+def iter_unspent_records(unspent_batch: UnspentBatch) -> Iterator[dict]:
+    """Построчно собрать записи выходов из столбцов UnspentBatch"""
+    for idx, transaction_id in enumerate(unspent_batch.transaction_ids):
+        sats_value = unspent_batch.sats_values[idx]
+        yield {
+            'transaction_id': transaction_id,
+            'output_index': unspent_batch.output_indexes[idx],
+            'btc_value': sats_value / SATS_IN_BTC,
+            'sats_value': sats_value,
+            'confirmations': unspent_batch.confirmations[idx],
+            'spendable': bool(unspent_batch.spendable[idx]),
+            'secure': bool(unspent_batch.secure[idx])
+        }
+
+
+def save_balance_report(report_data: dict, file_path: str) -> None:
+    """Сохранить результаты анализа в JSON-файл"""
+    report_payload = {
+        'address': report_data['address'],
+        'total_btc': str(report_data['total_btc']),
+        'total_sats': report_data['total_sats'],
+        'unspent_count': report_data['unspent_count'],
+        'unspent_list': list(iter_unspent_records(report_data['unspent_batch']))
+    }
+
+    # Кодируем целиком в память и записываем одной операцией: orjson, если
+    # установлен, иначе stdlib json (с indent он кодирует на чистом Python).
+    # Данные в обоих случаях одинаковы, но запись отличается косметически:
+    # orjson пишет 0.00001 вместо 1e-05 и не экранирует не-ASCII символы
+    if orjson is not None:
+        encoded_report = orjson.dumps(report_payload, option=orjson.OPT_INDENT_2, default=str)
     else:
-        print("Непотраченные выходы не обнаружены")
+        encoded_report = json.dumps(report_payload, indent=2, default=str).encode('utf-8')
+
+    with open(file_path, 'wb') as output_file:
+        output_file.write(encoded_report)
 
 
-def execute_analysis():
+def execute_analysis() -> None:
     # Параметры подключения к тестовой сети
     NODE_USERNAME = '***'
     NODE_CREDENTIAL = '***'
@@ -181,36 +463,32 @@ def execute_analysis():
         portfolio_label=PORTFOLIO_IDENTIFIER
     )
 
-    # Устанавливаем соединение
-    if not inspector.establish_link():
-        print("Не удалось подключиться к узлу Bitcoin")
-        return
+    try:
+        # Устанавливаем соединение
+        if not inspector.establish_link():
+            print("Не удалось подключиться к узлу Bitcoin")
+            return
 
-    # Запрашиваем общий баланс
-    portfolio_total = inspector.fetch_portfolio_total()
-    if portfolio_total:
-        print(f"Суммарный баланс портфеля: {portfolio_total['portfolio_btc']:.8f} BTC")
-
-    # Анализируем указанный адрес
-    print(f"\nАнализ адреса: {ANALYZED_ADDRESS}")
-    analysis_result = inspector.calculate_unspent_balance(ANALYZED_ADDRESS)
-
-    # Отображаем результаты
-    if analysis_result:
-        display_balance_report(analysis_result)
-
-        # Сохраняем в файл
-        with open('utxo_report.json', 'w') as output_file:
-            json.dump({
-                'address': analysis_result['address'],
-                'total_btc': str(analysis_result['total_btc']),
-                'total_sats': analysis_result['total_sats'],
-                'unspent_count': analysis_result['unspent_count'],
-                'unspent_list': analysis_result['unspent_list']
-            }, output_file, indent=2)
-        print("\nРезультаты сохранены в utxo_report.json")
-    else:
-        print("Не удалось получить данные по непотраченным выходам")
+        # Общий баланс — небольшой отдельный запрос
+        portfolio_total = inspector.fetch_portfolio_total()
+        if portfolio_total:
+            print(f"Суммарный баланс портфеля: {portfolio_total['portfolio_btc']:.8f} BTC")
+
+        # Анализируем указанный адрес; объемный ответ listunspent разбирается потоково
+        print(f"\nАнализ адреса: {ANALYZED_ADDRESS}")
+        analysis_result = inspector.calculate_unspent_balance(ANALYZED_ADDRESS)
+
+        # Отображаем результаты
+        if analysis_result:
+            display_balance_report(analysis_result)
+
+            # Сохраняем в файл
+            save_balance_report(analysis_result, 'utxo_report.json')
+            print("\nРезультаты сохранены в utxo_report.json")
+        else:
+            print("Не удалось получить данные по непотраченным выходам")
+    finally:
+        inspector.close()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,58 @@
-from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException
+import http.client
 from decimal import Decimal
 import hashlib
+import heapq
 import struct
+from typing import Optional, Union
+
+from btc_units import btc_to_sat, sat_to_btc_str
+from node_rpc import FastAuthProxy, JSONRPCException, HTTP_TIMEOUT, basic_auth_header
+from rpc_cache import block_aware_cache, clear_block_cache
+
+# Время жизни кэша непотраченных выходов в пределах одного блока (секунды)
+UNSPENT_CACHE_TTL = 30
+
+# Имя сети узла, запрошенное один раз за процесс: {(хост, порт): сеть}
+_chain_cache: dict[tuple[str, int], str] = {}
+
+# Базовые размеры компонентов транзакции (байты)
+BASE_TX_SIZE = 10
+INPUT_SIZE_NON_SEGWIT = 148
+INPUT_SIZE_SEGWIT = 68
+OUTPUT_SIZE = 34
+
+# Тип адреса сдачи: P2WPKH соответствует размерам выше и порогу пыли ниже
+CHANGE_ADDRESS_TYPE = 'bech32'
+
+# Минимальная сумма выхода P2WPKH, которую узел не считает пылью (сатоши);
+# меньшую сдачу sendrawtransaction отклоняет, поэтому она уходит в комиссию
+DUST_THRESHOLD_SATS = 294
+
+# Границы таблицы заранее рассчитанных размеров
+SIZE_TABLE_MAX_INPUTS = 50
+SIZE_TABLE_MAX_OUTPUTS = 4
+
+
+def _transaction_size(input_count: int, output_count: int, is_segwit: bool) -> int:
+    """Примерный размер транзакции в байтах"""
+    input_size = INPUT_SIZE_SEGWIT if is_segwit else INPUT_SIZE_NON_SEGWIT
+    return BASE_TX_SIZE + (input_count * input_size) + (output_count * OUTPUT_SIZE)
+
+
+# _SIZE_TABLE[is_segwit][input_count][output_count]
+_SIZE_TABLE = tuple(
+    tuple(
+        tuple(_transaction_size(input_count, output_count, is_segwit)
+              for output_count in range(SIZE_TABLE_MAX_OUTPUTS + 1))
+        for input_count in range(SIZE_TABLE_MAX_INPUTS + 1)
+    )
+    for is_segwit in (False, True)
+)
 
 
 class BitcoinTransactionCreator:
-    def __init__(self, node_user, node_pass, node_host='127.0.0.1', node_port=48332, wallet_id=''):
+    def __init__(self, node_user: str, node_pass: str, node_host: str = '127.0.0.1', node_port: int = 48332,
+                 wallet_id: str = '') -> None:
         """
         Инициализация подключения к узлу Bitcoin
 
@@ -27,20 +74,41 @@ class BitcoinTransactionCreator:
         else:
             self.connection_string = f"http://{node_user}:{node_pass}@{node_host}:{node_port}/"
 
-        self.node_client = None
+        # Путь RPC и заголовок авторизации вычисляются один раз для всех клиентов
+        self._path = f"/wallet/{wallet_id}" if wallet_id else "/"
+        self._auth_header = basic_auth_header(node_user, node_pass)
+
+        self.node_client: Optional[FastAuthProxy] = None
+        # Одно постоянное HTTP-соединение (keep-alive) на все RPC-вызовы
+        self._conn = http.client.HTTPConnection(node_host, node_port, timeout=HTTP_TIMEOUT)
+        # Кэш block_aware_cache: {(метод, аргументы): (лучший блок, время, результат)}
+        self._block_cache: dict[tuple, tuple] = {}
 
-    def connect_to_node(self):
+    def connect_to_node(self) -> bool:
         """Установить соединение с узлом"""
         try:
-            self.node_client = AuthServiceProxy(self.connection_string)
-            blockchain_info = self.node_client.getblockchaininfo()
-            print(f"✓ Подключено к сети: {blockchain_info['chain']}")
+            if self.node_client is None:
+                self.node_client = FastAuthProxy.from_connection(self._conn, self._path, self._auth_header)
+            # Полный getblockchaininfo нужен только при первом подключении,
+            # дальше для проверки связи достаточно getbestblockhash
+            node_key = (self.node_host, self.node_port)
+            chain = _chain_cache.get(node_key)
+            if chain is None:
+                chain = _chain_cache[node_key] = self.node_client.getblockchaininfo()['chain']
+            else:
+                self.node_client.getbestblockhash()
+            print(f"✓ Подключено к сети: {chain}")
             return True
         except Exception as error:
             print(f"✗ Ошибка подключения: {error}")
             return False
 
-    def calculate_transaction_fee(self, tx_size_bytes, sat_per_byte):
+    def close(self) -> None:
+        """Закрыть соединение с узлом"""
+        self._conn.close()
+        self.node_client = None
+
+    def calculate_transaction_fee(self, tx_size_bytes: int, sat_per_byte: int) -> int:
         """
         Рассчитать комиссию транзакции
 
@@ -53,7 +121,7 @@ class BitcoinTransactionCreator:
         """
         return tx_size_bytes * sat_per_byte
 
-    def create_raw_transaction(self, inputs_list, outputs_dict):
+    def create_raw_transaction(self, inputs_list: list[dict], outputs_dict: dict) -> Optional[str]:
         """
         Создать сырую транзакцию
 
@@ -75,7 +143,7 @@ class BitcoinTransactionCreator:
             print(f"✗ Ошибка создания транзакции: {rpc_error}")
             return None
 
-    def sign_transaction(self, raw_tx_hex):
+    def sign_transaction(self, raw_tx_hex: str) -> Optional[dict]:
         """
         Подписать транзакцию
 
@@ -85,6 +153,10 @@ class BitcoinTransactionCreator:
         Returns:
             dict: Подписанная транзакция или None при ошибке
         """
+        if not self.node_client:
+            print("Сначала подключитесь к узлу")
+            return None
+
         try:
             signed_tx = self.node_client.signrawtransactionwithwallet(raw_tx_hex)
             return signed_tx
@@ -92,7 +164,7 @@ class BitcoinTransactionCreator:
             print(f"✗ Ошибка подписания: {rpc_error}")
             return None
 
-    def broadcast_transaction(self, signed_tx_hex):
+    def broadcast_transaction(self, signed_tx_hex: str) -> Optional[str]:
         """
         Отправить транзакцию в сеть
 
@@ -102,14 +174,27 @@ class BitcoinTransactionCreator:
         Returns:
             str: Хеш транзакции или None при ошибке
         """
+        if not self.node_client:
+            print("Сначала подключитесь к узлу")
+            return None
+
         try:
             tx_hash = self.node_client.sendrawtransaction(signed_tx_hex)
+            # Отправленная транзакция тратит выходы — сохраненный список устарел
+            clear_block_cache(self)
             return tx_hash
         except JSONRPCException as rpc_error:
             print(f"✗ Ошибка отправки: {rpc_error}")
             return None
+        except (http.client.HTTPException, OSError) as error:
+            # Запрос не повторяется: узел мог принять транзакцию до разрыва
+            clear_block_cache(self)
+            print(f"✗ Соединение прервано во время отправки, проверьте транзакцию в кошельке: {error}")
+            return None
 
-    def get_unspent_outputs(self, min_confirmations=1, max_confirmations=9999999, addresses=None):
+    @block_aware_cache(ttl=UNSPENT_CACHE_TTL)
+    def get_unspent_outputs(self, min_confirmations: int = 1, max_confirmations: int = 9999999,
+                            addresses: Optional[list[str]] = None) -> list[dict]:
         """
         Получить непотраченные выходы
 
@@ -121,6 +206,10 @@ class BitcoinTransactionCreator:
         Returns:
             list: Список непотраченных выходов
         """
+        if not self.node_client:
+            print("Сначала подключитесь к узлу")
+            return []
+
         try:
             if addresses:
                 unspent = self.node_client.listunspent(min_confirmations, max_confirmations, addresses)
@@ -131,7 +220,27 @@ class BitcoinTransactionCreator:
             print(f"✗ Ошибка получения UTXO: {rpc_error}")
             return []
 
-    def estimate_transaction_size(self, input_count, output_count, is_segwit=True):
+    def get_change_address(self) -> Optional[str]:
+        """
+        Получить новый адрес для сдачи
+
+        Тип адреса задается явно (CHANGE_ADDRESS_TYPE), а не настройками
+        узла -changetype/-addresstype: от него зависят порог пыли и размер выхода.
+
+        Returns:
+            str: Адрес для сдачи или None при ошибке
+        """
+        if not self.node_client:
+            print("Сначала подключитесь к узлу")
+            return None
+
+        try:
+            return self.node_client.getrawchangeaddress(CHANGE_ADDRESS_TYPE)
+        except JSONRPCException as rpc_error:
+            print(f"✗ Ошибка получения адреса для сдачи: {rpc_error}")
+            return None
+
+    def estimate_transaction_size(self, input_count: int, output_count: int, is_segwit: bool = True) -> int:
         """
         Оценить размер транзакции
 
@@ -143,54 +252,75 @@ class BitcoinTransactionCreator:
         Returns:
             int: Примерный размер в байтах
         """
-        # Базовые размеры компонентов
-        BASE_TX_SIZE = 10
-        INPUT_SIZE_NON_SEGWIT = 148
-        INPUT_SIZE_SEGWIT = 68
-        OUTPUT_SIZE = 34
-
-        input_size = INPUT_SIZE_SEGWIT if is_segwit else INPUT_SIZE_NON_SEGWIT
-        estimated_size = BASE_TX_SIZE + (input_count * input_size) + (output_count * OUTPUT_SIZE)
+        # Типичные комбинации берем из заранее рассчитанной таблицы
+        if 0 <= input_count <= SIZE_TABLE_MAX_INPUTS and 0 <= output_count <= SIZE_TABLE_MAX_OUTPUTS:
+            return _SIZE_TABLE[bool(is_segwit)][input_count][output_count]
 
-        return estimated_size
+        return _transaction_size(input_count, output_count, is_segwit)
 
-    def select_inputs_for_amount(self, target_amount_btc, unspent_outputs):
+    def select_inputs_for_amount(self, target_amount_btc: Union[Decimal, float, str],
+                                 unspent_outputs: list[dict],
+                                 sat_per_byte: int = 0) -> tuple[list[dict], int, int]:
         """
-        Выбрать входы для указанной суммы
+        Выбрать входы для указанной суммы с учетом комиссии
+
+        Входы набираются, пока их сумма не покроет целевую сумму и комиссию
+        транзакции с уже выбранным числом входов, поэтому отдельная проверка
+        комиссии после выбора не приводит к отказу при достаточном балансе.
+
+        Сдача возвращается за вычетом комиссии транзакции с двумя выходами;
+        если она меньше порога пыли (DUST_THRESHOLD_SATS), возвращается 0 и
+        остаток уходит в комиссию — в том числе при sat_per_byte=0.
 
         Args:
             target_amount_btc: Целевая сумма в BTC
             unspent_outputs: Список непотраченных выходов
+            sat_per_byte: Комиссия в сатоши за байт (0 — без учета комиссии)
 
         Returns:
-            tuple: (список выбранных входов, общая сумма, сдача)
+            tuple: (список выбранных входов, общая сумма, сдача за вычетом комиссии)
         """
-        target_sats = int(Decimal(target_amount_btc) * Decimal('1e8'))
-        selected_inputs = []
+        target_sats = btc_to_sat(target_amount_btc)
+        selected_inputs: list[dict] = []
         total_sats = 0
 
-        # Сортируем по количеству подтверждений (сначала более подтвержденные)
-        sorted_outputs = sorted(unspent_outputs, key=lambda x: x['confirmations'], reverse=True)
+        # Порядок по количеству подтверждений (сначала более подтвержденные).
+        # Вместо полной сортировки строим кучу за O(n) и извлекаем из нее
+        # только те выходы, которые действительно понадобятся
+        candidates = [(-output['confirmations'], index) for index, output in enumerate(unspent_outputs)]
+        heapq.heapify(candidates)
 
-        for output in sorted_outputs:
-            if total_sats >= target_sats:
-                break
+        # Комиссия транзакции с k входами и одним выходом (без сдачи)
+        def required_sats(input_count: int) -> int:
+            fee_sats = self.calculate_transaction_fee(self.estimate_transaction_size(input_count, 1), sat_per_byte)
+            return target_sats + fee_sats
 
-            output_sats = int(Decimal(output['amount']) * Decimal('1e8'))
+        while candidates and total_sats < required_sats(len(selected_inputs)):
+            _, index = heapq.heappop(candidates)
+            output = unspent_outputs[index]
+
+            output_sats = btc_to_sat(output['amount'])
             selected_inputs.append({
                 "txid": output['txid'],
                 "vout": output['vout']
             })
             total_sats += output_sats
 
-        if total_sats < target_sats:
+        if total_sats < required_sats(len(selected_inputs)):
             return [], 0, 0
 
-        change_sats = total_sats - target_sats
+        # Сдача остается, только если после комиссии за дополнительный выход
+        # она не меньше порога пыли; иначе остаток уходит в комиссию
+        # транзакции с одним выходом
+        fee_with_change = self.calculate_transaction_fee(
+            self.estimate_transaction_size(len(selected_inputs), 2), sat_per_byte)
+        change_sats = total_sats - target_sats - fee_with_change
+        if change_sats < DUST_THRESHOLD_SATS:
+            change_sats = 0
         return selected_inputs, total_sats, change_sats
 
 
-def create_and_send_transaction():
+def create_and_send_transaction() -> None:
     """Пример создания и отправки транзакции"""
     # Параметры подключения
     NODE_USERNAME = 'username'
@@ -216,76 +346,76 @@ def create_and_send_transaction():
         wallet_id=WALLET_NAME
     )
 
-    # Подключение
-    if not tx_creator.connect_to_node():
-        return
-
-    # Получаем непотраченные выходы
-    unspent_outputs = tx_creator.get_unspent_outputs()
-    if not unspent_outputs:
-        print("Нет доступных непотраченных выходов")
-        return
-
-    # Выбираем входы для нужной суммы
-    inputs, total_sats, change_sats = tx_creator.select_inputs_for_amount(AMOUNT_BTC, unspent_outputs)
-    if not inputs:
-        print("Недостаточно средств")
-        return
-
-    # Оцениваем размер транзакции
-    output_count = 2 if change_sats > 0 else 1
-    estimated_size = tx_creator.estimate_transaction_size(len(inputs), output_count)
-
-    # Рассчитываем комиссию
-    fee_sats = tx_creator.calculate_transaction_fee(estimated_size, FEE_RATE)
-
-    # Проверяем, хватает ли средств с учетом комиссии
-    amount_sats = int(Decimal(AMOUNT_BTC) * Decimal('1e8'))
-    if total_sats < (amount_sats + fee_sats):
-        print(f"Недостаточно средств. Нужно: {amount_sats + fee_sats} сатоши, есть: {total_sats}")
-        return
-
-    # Пересчитываем сдачу с учетом комиссии
-    change_sats = total_sats - amount_sats - fee_sats
-
-    # Формируем выходы
-    outputs = {RECIPIENT_ADDRESS: Decimal(AMOUNT_BTC)}
-    if change_sats > 0:
-        # Получаем адрес для сдачи (первый адрес из кошелька)
-        try:
-            addresses = tx_creator.node_client.listreceivedbyaddress(0, True)
-            if addresses:
-                change_address = addresses[0]['address']
-                outputs[change_address] = Decimal(change_sats) / Decimal('1e8')
-        except:
-            print("Не удалось получить адрес для сдачи")
+    try:
+        # Подключение
+        if not tx_creator.connect_to_node():
+            return
+
+        # Получаем непотраченные выходы
+        unspent_outputs = tx_creator.get_unspent_outputs()
+        if not unspent_outputs:
+            print("Нет доступных непотраченных выходов")
+            return
+
+        # Выбираем входы для нужной суммы с учетом комиссии
+        inputs, total_sats, change_sats = tx_creator.select_inputs_for_amount(AMOUNT_BTC, unspent_outputs, FEE_RATE)
+        if not inputs:
+            print("Недостаточно средств")
             return
 
-    # Создаем сырую транзакцию
-    print("Создание сырой транзакции...")
-    raw_tx = tx_creator.create_raw_transaction(inputs, outputs)
-    if not raw_tx:
-        return
-
-    # Подписываем транзакцию
-    print("Подписание транзакции...")
-    signed_tx = tx_creator.sign_transaction(raw_tx)
-    if not signed_tx or not signed_tx.get('complete'):
-        print("Ошибка подписания транзакции")
-        return
-
-    # Отправляем транзакцию
-    print("Отправка транзакции в сеть...")
-    tx_hash = tx_creator.broadcast_transaction(signed_tx['hex'])
-
-    if tx_hash:
-        print(f"✓ Транзакция успешно отправлена!")
-        print(f"Хеш транзакции: {tx_hash}")
-        print(f"Сумма: {AMOUNT_BTC} BTC")
-        print(f"Комиссия: {fee_sats} сатоши ({Decimal(fee_sats) / Decimal('1e8'):.8f} BTC)")
-        print(f"Размер: ~{estimated_size} байт")
-    else:
-        print("✗ Не удалось отправить транзакцию")
+        # Оцениваем размер транзакции
+        output_count = 2 if change_sats > 0 else 1
+        estimated_size = tx_creator.estimate_transaction_size(len(inputs), output_count)
+
+        # Рассчитываем минимальную комиссию
+        min_fee_sats = tx_creator.calculate_transaction_fee(estimated_size, FEE_RATE)
+
+        # Проверяем, хватает ли средств с учетом комиссии
+        amount_sats = btc_to_sat(AMOUNT_BTC)
+        if total_sats < (amount_sats + min_fee_sats):
+            print(f"Недостаточно средств. Нужно: {amount_sats + min_fee_sats} сатоши, есть: {total_sats}")
+            return
+
+        # Фактическая комиссия: без сдачи в нее уходит весь остаток входов
+        fee_sats = total_sats - amount_sats - change_sats
+
+        # Формируем выходы; суммы передаем строками ровно с 8 знаками после точки
+        outputs = {RECIPIENT_ADDRESS: sat_to_btc_str(amount_sats)}
+        if change_sats > 0:
+            # Получаем новый адрес для сдачи (без повторного использования адресов)
+            change_address = tx_creator.get_change_address()
+            if not change_address:
+                print("Не удалось получить адрес для сдачи")
+                return
+            outputs[change_address] = sat_to_btc_str(change_sats)
+
+        # Создаем сырую транзакцию
+        print("Создание сырой транзакции...")
+        raw_tx = tx_creator.create_raw_transaction(inputs, outputs)
+        if not raw_tx:
+            return
+
+        # Подписываем транзакцию
+        print("Подписание транзакции...")
+        signed_tx = tx_creator.sign_transaction(raw_tx)
+        if not signed_tx or not signed_tx.get('complete'):
+            print("Ошибка подписания транзакции")
+            return
+
+        # Отправляем транзакцию
+        print("Отправка транзакции в сеть...")
+        tx_hash = tx_creator.broadcast_transaction(signed_tx['hex'])
+
+        if tx_hash:
+            print(f"✓ Транзакция успешно отправлена!")
+            print(f"Хеш транзакции: {tx_hash}")
+            print(f"Сумма: {AMOUNT_BTC} BTC")
+            print(f"Комиссия: {fee_sats} сатоши ({sat_to_btc_str(fee_sats)} BTC)")
+            print(f"Размер: ~{estimated_size} байт")
+        else:
+            print("✗ Не удалось отправить транзакцию")
+    finally:
+        tx_creator.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+import functools
+import time
+
+
+def _freeze(value):
+    """Привести аргументы вызова к хешируемому виду"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def block_aware_cache(ttl=None):
+    """
+    Кэшировать результат метода до появления нового блока
+
+    Перед обращением к кэшу у узла запрашивается getbestblockhash: пока хеш
+    лучшего блока не изменился, повторный вызов с теми же аргументами
+    возвращает сохраненный результат без RPC-запроса. Объект должен иметь
+    атрибут node_client; записи хранятся в атрибуте _block_cache (классы,
+    компилируемые mypyc, объявляют его в __init__).
+
+    Args:
+        ttl: Время жизни записи в секундах (для данных, зависящих от мемпула)
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.node_client is None:
+                return method(self, *args, **kwargs)
+
+            try:
+                best_block = self.node_client.getbestblockhash()
+            except Exception:
+                return method(self, *args, **kwargs)
+
+            cache = getattr(self, '_block_cache', None)
+            if cache is None:
+                cache = self._block_cache = {}
+            key = (method.__name__, _freeze(args), _freeze(kwargs))
+            entry = cache.get(key)
+            if entry is not None:
+                cached_block, cached_at, result = entry
+                if cached_block == best_block and (ttl is None or time.monotonic() - cached_at < ttl):
+                    return result
+
+            result = method(self, *args, **kwargs)
+            # Пустой результат методы возвращают и при ошибке RPC — его не сохраняем
+            if result:
+                cache[key] = (best_block, time.monotonic(), result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def clear_block_cache(instance):
+    """Сбросить кэш объекта (например, после отправки транзакции)"""
+    instance._block_cache = {}